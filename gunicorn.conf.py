@@ -0,0 +1,25 @@
+# Gunicorn settings for the DeepSeek OCR Web App: gunicorn -c gunicorn.conf.py server:app
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
+
+# OCR requests spend nearly all their time waiting on Ollama, so threads do the
+# concurrency; a few processes spread page rendering and image work over the CPUs
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# For gthread workers this is the worker heartbeat, not a per-request limit: the worker's main
+# thread keeps checking in while request threads wait on Ollama, so a slow call is not cut off.
+# Model calls are bounded only by OLLAMA_TIMEOUT, which limits each connect and each read
+# between chunks, not the call as a whole
+timeout = 180
+keepalive = 5
+
+# Workers touch a heartbeat file every few seconds; keep it in RAM where available
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Each worker imports the app itself: the executors, OCR batcher, warm-up thread and
+# SQLite connections created at import must not be shared across a fork
+preload_app = False
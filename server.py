@@ -4,24 +4,99 @@ DeepSeek OCR Web Application
 Simple Flask server for uploading images and running OCR via Ollama
 """
 
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
-import subprocess
+from flask import Flask, Response, request, jsonify, send_from_directory, abort
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
+from PIL import Image, ImageOps
+import pymupdf
+
+try:
+    import brotli  # Optional: lets the index page be served brotli-compressed
+except ImportError:
+    brotli = None
 import os
+import sys
+import functools
+import gzip
+import hashlib
+import io
 import base64
+import requests
+from urllib3.exceptions import ReadTimeoutError
+import orjson
 from pathlib import Path
+from urllib.parse import quote, unquote
 import json
 import sqlite3
-from datetime import datetime
+import threading
+import queue
+import time
+import secrets
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
 from contextlib import contextmanager
 
+# `python server.py` replaces itself with Gunicorn (configured by gunicorn.conf.py next to this
+# file) before the app is built, so the database, executors and model warm-up are only ever set
+# up inside the workers. The Flask development server is used under FLASK_ENV=development and
+# on Windows, where Gunicorn does not run; see the bottom of this file
+if __name__ == '__main__' and os.environ.get('FLASK_ENV') != 'development' and os.name != 'nt':
+    print("Starting DeepSeek OCR Web App...")
+    print("Open http://localhost:8080 in your browser", flush=True)  # exec discards unflushed output
+    here = Path(__file__).resolve().parent
+    os.execvp(sys.executable, [
+        sys.executable, '-m', 'gunicorn',
+        '-c', str(here / 'gunicorn.conf.py'),
+        '--pythonpath', str(here),
+        f'{Path(__file__).stem}:app'
+    ])
+
 app = Flask(__name__)
 
 # Configuration
 UPLOAD_FOLDER = Path('uploads')
 UPLOAD_FOLDER.mkdir(exist_ok=True)
+THUMB_FOLDER = UPLOAD_FOLDER / 'thumb'
+THUMB_FOLDER.mkdir(exist_ok=True)
+THUMBNAIL_SIZE = (256, 256)
+PDF_DPI = 200  # Resolution PDF pages are rendered at before OCR
+MAX_PDF_PAGES = 20  # Every page is rendered and sent to the model, so longer PDFs are rejected
+ALLOWED_IMAGE_FORMATS = {'JPEG', 'PNG', 'WEBP', 'TIFF'}
+MODEL_IMAGE_FORMATS = {'JPEG', 'PNG'}  # What Ollama can decode; other uploads are converted to PNG
+PNG_MODES = {'1', 'L', 'LA', 'P', 'RGB', 'RGBA'}
+EXIF_ORIENTATION = 0x0112
+ALLOWED_SUFFIXES = {'.pdf', '.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff'}
+MAX_IMAGE_DIMENSION = 4096  # Larger images are rejected outright
+OCR_IMAGE_SIZE = (2048, 2048)  # Larger images are downscaled before OCR; the vision encoder works below this
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+MAX_UPLOAD_SIZE = 16 * 1024 * 1024  # 16MB max file size, enforced while the upload streams in
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE  # Backstop for Werkzeug's own form parsing
+# Behind Apache/lighttpd, hand file responses to the front-end server via X-Sendfile
+app.use_x_sendfile = os.environ.get('USE_X_SENDFILE') == '1'
+# Behind nginx, the internal location that aliases uploads/ (e.g. /internal-uploads/); files are
+# then handed over with X-Accel-Redirect instead of being sent from Python
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '')
 DB_PATH = 'ocr_data.db'
+COPY_BUFFER_SIZE = 1 << 20  # 1MB chunks when writing uploads to disk
+UPLOAD_MAX_AGE = 365 * 24 * 60 * 60  # Browser cache lifetime for uploads and thumbnails (one year)
+RESULTS_PAGE_SIZE = int(os.environ.get('RESULTS_PAGE_SIZE', '20'))  # Results per page when ?limit= is not given
+RESULTS_MAX = int(os.environ.get('RESULTS_MAX', '200'))  # Largest page /results will return
+RESULTS_PREVIEW_CHARS = 200  # Listings carry this much of each output; the rest is fetched on demand
+
+# Ollama daemon HTTP API - a single pooled session keeps connections alive across requests
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://127.0.0.1:11434')
+# How long models stay resident in VRAM after a call: seconds (-1 = forever) or a duration like '30m'
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '-1')
+if OLLAMA_KEEP_ALIVE.lstrip('-').isdigit():
+    OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE)
+# Models to load into memory at startup (comma separated, empty to disable)
+OLLAMA_WARMUP = os.environ.get('OLLAMA_WARMUP', 'deepseek-ocr')
+OLLAMA_TIMEOUT = 120  # Per connect and per read, not a limit on the whole call
+SESSION = requests.Session()
+# Cap in-flight Ollama calls to what the GPU can run at once; extra requests wait their turn
+OCR_CONCURRENCY = int(os.environ.get('OCR_CONCURRENCY', '4'))
+OCR_SEMAPHORE = threading.BoundedSemaphore(OCR_CONCURRENCY)
+SESSION.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=OCR_CONCURRENCY))
 
 # Model cost per 1K tokens (approximate pricing for local models - using token estimates)
 # For local models, we'll estimate based on model size and time
@@ -30,24 +105,70 @@ MODEL_COSTS = {
     'llava': {'input': 0.0001, 'output': 0.0001},
     'moondream': {'input': 0.00005, 'output': 0.00005}  # Smaller model, lower cost estimate
 }
+# Models priced at zero in MODEL_COSTS; calculate_cost returns 0.0 for them without any arithmetic
+FREE_MODELS = frozenset(model for model, costs in MODEL_COSTS.items() if not any(costs.values()))
+
+# Per-connection settings, applied to every connection. journal_mode=WAL is stored in the
+# database file itself, so init_db() sets it once instead
+SQLITE_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',  # With WAL, fsync only at checkpoints
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',  # 64MB page cache
+    'PRAGMA mmap_size=268435456'  # 256MB memory-mapped reads
+)
+
+# One connection per thread, reused across requests and closed when its thread exits
+_db_local = threading.local()
+
+def _drop_inherited_connection():
+    # A forked child must not touch the parent's SQLite handle; it opens its own on first use
+    _db_local.__dict__.pop('conn', None)
+
+if hasattr(os, 'register_at_fork'):  # Unix only; there is no fork to guard against elsewhere
+    os.register_at_fork(after_in_child=_drop_inherited_connection)
+
+def _connect():
+    # Room for every statement below plus ad-hoc ones, so none is evicted and re-prepared.
+    # Autocommit mode: get_db() opens transactions explicitly, and only for writes
+    conn = sqlite3.connect(DB_PATH, cached_statements=256, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
 
 @contextmanager
-def get_db():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+def get_db(write=False):
+    """Context manager for database connections; each thread reuses its own connection.
+
+    Reads run without a transaction (WAL gives each statement a consistent snapshot).
+    With write=True the whole block is one transaction, started with BEGIN IMMEDIATE so
+    it takes the write lock up front rather than failing with "database is locked" when
+    upgrading midway, and committed on exit - callers must not commit themselves.
+    """
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = _db_local.conn = _connect()
+    if not write:
+        yield conn
+        return
+
+    conn.execute('BEGIN IMMEDIATE')
     try:
         yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
         raise
-    finally:
-        conn.close()
 
 def init_db():
     """Initialize the database with required tables"""
-    with get_db() as conn:
+    # WAL lets readers run alongside the writer; it persists, so every later connection uses it.
+    # Set outside a transaction, as journal mode can't change inside one
+    conn = _connect()
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.close()
+
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
 
         # Main interactions table
@@ -79,22 +200,501 @@ def init_db():
             )
         ''')
 
-        conn.commit()
+        # Newest-first listing for /results and the results table. The id tie-breaker is part
+        # of the key so ORDER BY timestamp DESC, id DESC needs no sort; it replaces an older
+        # timestamp-only index
+        cursor.execute('DROP INDEX IF EXISTS idx_interactions_ts')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_interactions_ts_id
+            ON interactions(timestamp DESC, id DESC)
+        ''')
+
+        # Per-interaction chat history in order
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chat_interaction_ts
+            ON chat_messages(interaction_id, timestamp)
+        ''')
+
+        # Lookup of earlier results for the same image, intent and model
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_interactions_lookup
+            ON interactions(filename, intent, model)
+        ''')
+
+        # Running usage totals, so /stats reads one row instead of summing both tables
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_interactions INTEGER NOT NULL DEFAULT 0,
+                total_tokens INTEGER NOT NULL DEFAULT 0,
+                total_cost REAL NOT NULL DEFAULT 0.0
+            )
+        ''')
+
+        # Seed from any existing history the first time the table is created
+        cursor.execute('''
+            INSERT OR IGNORE INTO stats (id, total_interactions, total_tokens, total_cost)
+            SELECT 1,
+                   (SELECT COUNT(*) FROM interactions),
+                   (SELECT COALESCE(SUM(input_tokens + output_tokens), 0) FROM interactions)
+                       + (SELECT COALESCE(SUM(tokens), 0) FROM chat_messages),
+                   (SELECT COALESCE(SUM(estimated_cost), 0.0) FROM interactions)
+                       + (SELECT COALESCE(SUM(cost), 0.0) FROM chat_messages)
+        ''')
+
+        # Keep the totals current inside the same transaction as every insert
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS stats_after_interaction
+            AFTER INSERT ON interactions
+            BEGIN
+                UPDATE stats
+                SET total_interactions = total_interactions + 1,
+                    total_tokens = total_tokens + COALESCE(NEW.input_tokens, 0) + COALESCE(NEW.output_tokens, 0),
+                    total_cost = total_cost + COALESCE(NEW.estimated_cost, 0.0)
+                WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS stats_after_chat_message
+            AFTER INSERT ON chat_messages
+            BEGIN
+                UPDATE stats
+                SET total_tokens = total_tokens + COALESCE(NEW.tokens, 0),
+                    total_cost = total_cost + COALESCE(NEW.cost, 0.0)
+                WHERE id = 1;
+            END
+        ''')
 
 # Initialize database on startup
 init_db()
 
-def estimate_tokens(text):
-    """Rough estimate of tokens (approximately 1 token per 4 characters)"""
-    return len(text) // 4
+# SQL run on the request path. sqlite3 keeps prepared statements in a per-connection
+# cache keyed by the SQL text, so each of these is parsed once per thread.
+SQL_INSERT_INTERACTION = '''
+    INSERT INTO interactions (filename, intent, output, model, input_tokens, output_tokens, estimated_cost)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_CHAT = '''
+    INSERT INTO chat_messages (interaction_id, role, content, tokens, cost)
+    VALUES (?, ?, ?, ?, ?)
+'''
+SQL_FIND_CACHED = '''
+    SELECT output
+    FROM interactions
+    WHERE filename = ? AND intent = ? AND model = ?
+    ORDER BY id DESC
+    LIMIT 1
+'''
+SQL_RESULTS_VERSION = 'SELECT MAX(id) FROM interactions'
+SQL_SELECT_RESULTS_PAGE = '''
+    SELECT id, filename, intent, substr(output, 1, ?) AS output, length(output) > ? AS truncated,
+           model, input_tokens, output_tokens, estimated_cost, timestamp
+    FROM interactions
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ? OFFSET ?
+'''
+SQL_SELECT_RESULT = '''
+    SELECT id, filename, intent, output, model, input_tokens, output_tokens,
+           estimated_cost, timestamp
+    FROM interactions
+    WHERE id = ?
+'''
+SQL_SELECT_INTERACTION_META = '''
+    SELECT filename, model
+    FROM interactions
+    WHERE id = ?
+'''
+SQL_SELECT_STATS = '''
+    SELECT total_interactions, total_tokens, total_cost
+    FROM stats
+    WHERE id = 1
+'''
+SQL_SELECT_CHAT_HISTORY = '''
+    SELECT role, content, tokens, cost, timestamp
+    FROM chat_messages
+    WHERE interaction_id = ?
+    ORDER BY timestamp ASC
+'''
+
+class OllamaError(RuntimeError):
+    """Raised when the Ollama daemon answers with an error status"""
+
+def ollama_generate(model, prompt, images=None):
+    """Run a single non-streaming /api/generate call and return the decoded JSON body"""
+    payload = {
+        'model': model,
+        'prompt': prompt,
+        'stream': False,
+        'keep_alive': OLLAMA_KEEP_ALIVE
+    }
+    if images:
+        payload['images'] = images
+
+    # orjson serializes the multi-MB base64 image payload far faster than the stdlib encoder
+    body = orjson.dumps(payload)
+    with OCR_SEMAPHORE:
+        response = SESSION.post(
+            f'{OLLAMA_URL}/api/generate',
+            data=body,
+            headers={'Content-Type': 'application/json'},
+            timeout=OLLAMA_TIMEOUT
+        )
+
+    if not response.ok:
+        raise OllamaError(f'Ollama error: {response.text}')
+    return orjson.loads(response.content)
+
+class OcrBatcher:
+    """Groups OCR requests that are waiting at the same time and dispatches them to a worker pool.
+
+    Ollama's /api/generate takes one prompt per call, so nothing is merged: each request
+    is still its own call. A request that arrives alone is dispatched at once; requests
+    that queued up meanwhile (up to max_batch_size) are handed to the pool ordered by
+    model, so same-model requests start together. With several pool workers they still
+    overlap, so this reduces model swaps in the daemon rather than ruling them out.
+    """
+
+    def __init__(self, max_batch_size=8, workers=OCR_CONCURRENCY):
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr')
+        threading.Thread(target=self._run, name='ocr-batcher', daemon=True).start()
+
+    def submit(self, model, prompt, image_b64):
+        """Queue an OCR request; the returned Future resolves to the Ollama JSON response"""
+        future = Future()
+        self._queue.put((model, prompt, image_b64, future))
+        return future
+
+    def _collect(self):
+        # Block for the first request only; never wait for company that may not come
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            batch.sort(key=lambda item: item[0])
+            for model, prompt, image_b64, future in batch:
+                self._executor.submit(self._dispatch, model, prompt, image_b64, future)
+
+    @staticmethod
+    def _dispatch(model, prompt, image_b64, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(ollama_generate(model, prompt, [image_b64]))
+        except Exception as e:
+            future.set_exception(e)
+
+OCR_BATCHER = OcrBatcher()
+
+def warm_up_models():
+    """Load the OLLAMA_WARMUP models ahead of the first request so no user waits on a cold start"""
+    for model in filter(None, (name.strip() for name in OLLAMA_WARMUP.split(','))):
+        try:
+            # An empty prompt makes Ollama load the model and return without generating
+            ollama_generate(model, '')
+        except (requests.RequestException, OllamaError) as e:
+            app.logger.warning('Could not warm up %s: %s', model, e)
+
+def ollama_generate_stream(model, prompt, images=None):
+    """Run a streaming /api/generate call, yielding each decoded JSON chunk as it arrives"""
+    payload = {
+        'model': model,
+        'prompt': prompt,
+        'stream': True,
+        'keep_alive': OLLAMA_KEEP_ALIVE
+    }
+    if images:
+        payload['images'] = images
+
+    with OCR_SEMAPHORE:
+        with SESSION.post(
+            f'{OLLAMA_URL}/api/generate',
+            data=orjson.dumps(payload),
+            headers={'Content-Type': 'application/json'},
+            timeout=OLLAMA_TIMEOUT,
+            stream=True
+        ) as response:
+            if not response.ok:
+                raise OllamaError(f'Ollama error: {response.text}')
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = orjson.loads(line)
+                    if 'error' in chunk:
+                        raise OllamaError(f"Ollama error: {chunk['error']}")
+                    yield chunk
+            except requests.ConnectionError as e:
+                # requests reports a read timeout mid-body as a ConnectionError; surface it as one
+                if e.args and isinstance(e.args[0], ReadTimeoutError):
+                    raise requests.ReadTimeout(*e.args, request=e.request, response=e.response) from e
+                raise
+
+# Decoding, downscaling, PDF rasterization and base64 encoding are CPU-bound; run them off the
+# request threads, at most one per core, so concurrent uploads can't pile up multi-MB buffers
+IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='image')
+
+def render_page(page, zoom, max_size):
+    """Render a PDF page at `zoom`, scaled down further if needed so it fits within max_size pixels"""
+    # Page sizes come from the file (up to 14400pt a side), so the zoom alone does not bound memory
+    rect = page.rect
+    zoom = min(zoom, max_size[0] / max(rect.width, 1), max_size[1] / max(rect.height, 1))
+    return page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom))
+
+def rasterize_pdf(filepath, dpi=PDF_DPI, max_pages=None):
+    """Render the pages of a PDF (all, or the first max_pages) to PNG bytes, each no larger than OCR_IMAGE_SIZE"""
+    with pymupdf.open(filepath) as doc:
+        return [render_page(page, dpi / 72, OCR_IMAGE_SIZE).tobytes('png') for page in doc.pages(0, max_pages)]
+
+threading.Thread(target=warm_up_models, name='ollama-warmup', daemon=True).start()
 
 def calculate_cost(input_tokens, output_tokens, model='deepseek-ocr'):
     """Calculate estimated cost based on token usage"""
+    if model in FREE_MODELS:
+        return 0.0
     costs = MODEL_COSTS.get(model, MODEL_COSTS['deepseek-ocr'])
     input_cost = (input_tokens / 1000) * costs['input']
     output_cost = (output_tokens / 1000) * costs['output']
     return input_cost + output_cost
 
+def store_upload(stream, original_name):
+    """Stream an upload to disk under a name derived from its content hash.
+
+    Returns (filename, filepath). Identical files map to the same name, so a
+    re-upload reuses the copy already on disk. Raises RequestEntityTooLarge as
+    soon as more than MAX_UPLOAD_SIZE bytes have been read, and ValueError (from
+    validate_upload) for a file that must not be stored.
+    """
+    # Unique per request, so concurrent uploads never share a temp file
+    tmp_path = UPLOAD_FOLDER / f".{time.time_ns()}_{secrets.token_hex(4)}.part"
+    digest = hashlib.blake2b(digest_size=16)
+    total = 0
+    try:
+        with open(tmp_path, 'wb', buffering=COPY_BUFFER_SIZE) as dst:
+            while chunk := stream.read(COPY_BUFFER_SIZE):
+                total += len(chunk)
+                if total > MAX_UPLOAD_SIZE:
+                    raise RequestEntityTooLarge()
+                digest.update(chunk)
+                dst.write(chunk)
+    except BaseException:
+        # Oversized body, client disconnect or disk error: don't leave the partial copy behind
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    # The client's name only contributes its extension, already checked against ALLOWED_SUFFIXES
+    suffix = Path(original_name).suffix.lower()
+    filename = f"{digest.hexdigest()}{suffix}"
+    filepath = UPLOAD_FOLDER / filename
+    try:
+        # Checked on the private temp copy: a rejected upload never touches the published blob,
+        # which earlier interactions may already point to
+        validate_upload(tmp_path, suffix)
+        # Publishes the blob atomically and, unlike a rename, never replaces an existing one
+        os.link(tmp_path, filepath)
+    except FileExistsError:
+        pass  # Same content already stored; keep the existing file (and its mtime for caching)
+    finally:
+        tmp_path.unlink()
+    return filename, filepath
+
+def validate_upload(filepath, suffix):
+    """Cheaply check that an upload is a usable image or PDF before any model call.
+
+    `suffix` is the extension the file will be stored under. Raises ValueError with a
+    user-facing message otherwise.
+    """
+    if suffix == '.pdf':
+        try:
+            with pymupdf.open(filepath, filetype='pdf') as doc:
+                page_count = doc.page_count
+        except RuntimeError:
+            raise ValueError('Uploaded file is not a valid PDF')
+        if page_count == 0:
+            raise ValueError('PDF has no pages')
+        if page_count > MAX_PDF_PAGES:
+            raise ValueError(f'PDF has {page_count} pages; the maximum is {MAX_PDF_PAGES}')
+        return
+
+    try:
+        # verify() only parses headers and checksums, it does not decode pixel data
+        with Image.open(filepath) as im:
+            im.verify()
+            image_format, size = im.format, im.size
+    except Exception:
+        raise ValueError('Uploaded file is not a valid image')
+
+    if image_format not in ALLOWED_IMAGE_FORMATS:
+        raise ValueError(f'Unsupported image format: {image_format}')
+    if max(size) > MAX_IMAGE_DIMENSION:
+        raise ValueError(f'Image is too large ({size[0]}x{size[1]}); the maximum is {MAX_IMAGE_DIMENSION}px per side')
+
+def load_ocr_image(filepath):
+    """Return the image bytes to send to the model: JPEG or PNG, downscaled to OCR_IMAGE_SIZE if needed"""
+    with Image.open(filepath) as im:
+        fits = im.width <= OCR_IMAGE_SIZE[0] and im.height <= OCR_IMAGE_SIZE[1]
+        upright = im.getexif().get(EXIF_ORIENTATION, 1) == 1
+        if fits and upright and im.format in MODEL_IMAGE_FORMATS:
+            return filepath.read_bytes()
+
+        # Ollama only decodes JPEG and PNG, so TIFF and WEBP uploads are always re-encoded.
+        # Re-encoding drops EXIF, so rotate phone photos upright first
+        image_format = 'JPEG' if im.format == 'JPEG' else 'PNG'
+        im = ImageOps.exif_transpose(im)
+        if not fits:
+            im.thumbnail(OCR_IMAGE_SIZE, Image.Resampling.LANCZOS)
+        if image_format == 'JPEG' and im.mode != 'RGB':
+            im = im.convert('RGB')
+        elif image_format == 'PNG' and im.mode not in PNG_MODES:
+            im = im.convert('RGBA' if 'A' in im.mode else 'RGB')  # e.g. CMYK or 16-bit TIFF
+        buf = io.BytesIO()
+        im.save(buf, image_format, quality=90)
+        return buf.getvalue()
+
+def open_preview(filepath):
+    """Open an upload as a PIL image; PDFs are represented by a low-resolution render of their first page"""
+    if filepath.suffix != '.pdf':
+        return Image.open(filepath)
+
+    with pymupdf.open(filepath) as doc:
+        pix = render_page(doc[0], 0.5, THUMBNAIL_SIZE)
+        return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+def make_thumbnail(filepath):
+    """Write a small JPEG preview of an uploaded image; returns its path, or None if the file is not an image"""
+    thumb_path = THUMB_FOLDER / f"{filepath.stem}.jpg"
+    if thumb_path.exists():
+        return thumb_path
+
+    # Unique across threads and worker processes, which may all render the same thumbnail at once
+    tmp_path = thumb_path.with_suffix(f".{time.time_ns()}_{secrets.token_hex(4)}.part")
+    try:
+        with open_preview(filepath) as im:
+            im.draft('RGB', THUMBNAIL_SIZE)  # Let JPEG decode at reduced scale
+            upright = ImageOps.exif_transpose(im)  # Browsers show the original rotated per EXIF
+            upright.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+            upright.convert('RGB').save(tmp_path, 'JPEG', quality=80, optimize=True)
+    except (OSError, RuntimeError):
+        tmp_path.unlink(missing_ok=True)
+        return None
+
+    tmp_path.replace(thumb_path)
+    return thumb_path
+
+def receive_upload():
+    """Store and validate the file posted to an upload endpoint.
+
+    Accepts either a multipart form with a 'file' field, or the raw file as an
+    application/octet-stream body named by the X-Filename header (URL-encoded).
+    Returns (filename, filepath); raises ValueError with a user-facing message on bad input.
+    Must run before anything touches request.form, so oversized bodies are refused unread.
+    """
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_SIZE:
+        raise RequestEntityTooLarge()
+
+    if request.mimetype == 'application/octet-stream':
+        # Raw body: copied straight off the socket, no multipart parsing or temp-file spooling
+        original_name = unquote(request.headers.get('X-Filename', ''))
+        stream = request.stream
+    else:
+        if 'file' not in request.files:
+            raise ValueError('No file provided')
+        file = request.files['file']
+        original_name = file.filename
+        stream = file.stream
+
+    if original_name == '':
+        raise ValueError('No file selected')
+    # Taken from the raw name: secure_filename() drops the extension of non-ASCII names
+    suffix = Path(original_name).suffix.lower()
+    if suffix not in ALLOWED_SUFFIXES:
+        raise ValueError(f'Unsupported file type: {suffix or "no extension"}')
+
+    # Store the upload under its content hash, rejecting corrupt, unsupported or oversized
+    # files before spending time on the model
+    filename, filepath = store_upload(stream, original_name)
+
+    # Build the preview alongside page encoding and the model call instead of before them;
+    # if a client asks for it first, the thumbnail route makes it on demand
+    IMAGE_EXECUTOR.submit(make_thumbnail, filepath)
+    return filename, filepath
+
+def encode_pages(filepath, max_pages=None):
+    """Return the base64 images to OCR for an upload: one entry per PDF page, or the image itself"""
+    if filepath.suffix == '.pdf':
+        pages = rasterize_pdf(filepath, max_pages=max_pages)
+    else:
+        pages = [load_ocr_image(filepath)]
+    return [base64.b64encode(page).decode('ascii') for page in pages]
+
+# Uploads are named by content hash and never change, so an encoded image can be reused
+# for the follow-up chat turns about it. An entry is the base64 upload (up to ~21MB for a
+# 16MB file), so only a handful are kept per worker.
+@functools.lru_cache(maxsize=4)
+def _load_image_pages(filepath):
+    return tuple(IMAGE_EXECUTOR.submit(encode_pages, filepath).result())
+
+def load_pages(filepath):
+    """Prepare an upload for OCR on IMAGE_EXECUTOR and wait for the encoded pages"""
+    if filepath.suffix == '.pdf':
+        # Rendered pages run to several MB each, so multi-page documents are never cached
+        return tuple(IMAGE_EXECUTOR.submit(encode_pages, filepath).result())
+    return _load_image_pages(filepath)
+
+@functools.lru_cache(maxsize=4)
+def _load_pdf_first_page(filepath):
+    return tuple(IMAGE_EXECUTOR.submit(encode_pages, filepath, 1).result())
+
+def load_chat_pages(filepath):
+    """The image a chat turn is about: the upload itself, or only the first page of a PDF.
+
+    Vision chat models take one image per prompt, and a single bounded page keeps each
+    turn cheap enough to cache, where a whole PDF would be re-rendered on every question.
+    """
+    if filepath.suffix == '.pdf':
+        return _load_pdf_first_page(filepath)
+    return _load_image_pages(filepath)
+
+GROUNDING_PREFIX = '<|grounding|>'
+DESCRIBE_PREFIX = 'describe this image'
+
+def _grounded_prompt(intent):
+    # Add <|grounding|> prefix if not already present and not a general description;
+    # only the leading characters are case-folded, not the whole intent
+    if intent[:len(DESCRIBE_PREFIX)].lower() == DESCRIBE_PREFIX or intent.startswith(GROUNDING_PREFIX):
+        return intent
+    return f"{GROUNDING_PREFIX}{intent}"
+
+# Prompts for the intents offered in the UI, resolved once at import
+PROMPTS = {intent: _grounded_prompt(intent) for intent in (
+    'Convert the document to markdown.',
+    'OCR this image.',
+    'Free OCR.',
+    'Parse the figure.',
+    'Describe this image in detail.',
+)}
+
+def build_prompt(intent):
+    """Build the OCR prompt; the image itself travels in the request's images field"""
+    prompt = PROMPTS.get(intent)
+    return prompt if prompt is not None else _grounded_prompt(intent)
+
+def find_cached_result(filename, intent, model):
+    """Return the most recent output for the same image, intent and model, if any"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_FIND_CACHED, (filename, intent, model))
+        row = cursor.fetchone()
+        return row['output'] if row else None
+
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
 <html lang="en">
@@ -409,7 +1009,7 @@ HTML_TEMPLATE = '''
             <form id="uploadForm">
                 <div class="form-group">
                     <label for="fileInput">Select Image or PDF:</label>
-                    <input type="file" id="fileInput" name="file" accept="image/*,.pdf" required>
+                    <input type="file" id="fileInput" name="file" accept="image/jpeg,image/png,image/webp,image/tiff,.pdf" required>
                 </div>
 
                 <div class="form-group">
@@ -443,6 +1043,7 @@ HTML_TEMPLATE = '''
             </form>
 
             <div id="message"></div>
+            <pre id="liveOutput" class="output-text" style="display: none; margin-top: 15px;"></pre>
         </div>
 
         <div class="stats-section">
@@ -471,6 +1072,17 @@ HTML_TEMPLATE = '''
         </div>
     </div>
 
+    <template id="chatMessageTpl">
+        <div class="chat-message">
+            <div class="chat-role" style="font-weight: bold; margin-bottom: 5px;"></div>
+            <div class="chat-content"></div>
+            <div class="chat-meta" style="font-size: 11px; margin-top: 5px; opacity: 0.8;"></div>
+        </div>
+    </template>
+    <template id="chatEmptyTpl">
+        <div style="color: #666; font-style: italic; text-align: center;">No chat history yet. Ask a question about this image!</div>
+    </template>
+
     <script>
         const form = document.getElementById('uploadForm');
         const submitBtn = document.getElementById('submitBtn');
@@ -479,6 +1091,9 @@ HTML_TEMPLATE = '''
         const intentSelect = document.getElementById('intentSelect');
         const customIntentGroup = document.getElementById('customIntentGroup');
         const customIntentInput = document.getElementById('customIntent');
+        const chatMessageTpl = document.getElementById('chatMessageTpl');
+        const chatEmptyTpl = document.getElementById('chatEmptyTpl');
+        const liveOutput = document.getElementById('liveOutput');
 
         // Show/hide custom intent input
         intentSelect.addEventListener('change', function() {
@@ -495,10 +1110,17 @@ HTML_TEMPLATE = '''
         loadResults();
         loadStats();
 
+        // Pick up results stored by other clients; an unchanged list costs only a 304
+        setInterval(() => {
+            if (!document.hidden) {
+                refreshResults();
+                loadStats();
+            }
+        }, 10000);
+
         form.addEventListener('submit', async function(e) {
             e.preventDefault();
 
-            const formData = new FormData();
             const fileInput = document.getElementById('fileInput');
             const modelSelect = document.getElementById('modelSelect');
             const file = fileInput.files[0];
@@ -519,29 +1141,47 @@ HTML_TEMPLATE = '''
                 intent = intentSelect.value;
             }
 
-            formData.append('file', file);
-            formData.append('intent', intent);
-            formData.append('model', modelSelect.value);
+            // Send the file as the raw request body so the server can stream it straight to disk
+            const params = new URLSearchParams({ intent: intent, model: modelSelect.value });
 
             submitBtn.disabled = true;
             submitBtn.textContent = 'Processing...';
             showMessage('Uploading and processing image...', 'loading');
 
             try {
-                const response = await fetch('/upload', {
+                const response = await fetch(`/upload/stream?${params}`, {
                     method: 'POST',
-                    body: formData
+                    headers: {
+                        'Content-Type': 'application/octet-stream',
+                        'X-Filename': encodeURIComponent(file.name)
+                    },
+                    body: file
                 });
 
-                const data = await response.json();
+                if (!response.ok) {
+                    const data = await response.json();
+                    showMessage('Error: ' + data.error, 'error');
+                    return;
+                }
+
+                // Show tokens as the model produces them
+                showMessage('Processing image...', 'loading');
+                liveOutput.textContent = '';
+                liveOutput.style.display = 'block';
 
-                if (response.ok) {
+                let result = null;
+                await readEvents(response, data => {
+                    if (data.response) liveOutput.textContent += data.response;
+                    if (data.done || data.error) result = data;
+                });
+
+                if (result && result.done) {
                     showMessage('Processing complete!', 'success');
                     form.reset();
-                    loadResults();
+                    refreshResults();
                     loadStats();
                 } else {
-                    showMessage('Error: ' + data.error, 'error');
+                    showMessage('Error: ' + (result ? result.error : 'Connection closed before processing finished'), 'error');
                 }
             } catch (error) {
                 showMessage('Error: ' + error.message, 'error');
@@ -551,83 +1191,119 @@ HTML_TEMPLATE = '''
             }
         });
 
+        // Read a text/event-stream response, passing each decoded data payload to onEvent
+        async function readEvents(response, onEvent) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+                for (const event of events) {
+                    if (event.startsWith('data: ')) onEvent(JSON.parse(event.slice(6)));
+                }
+            }
+        }
+
         function showMessage(msg, type) {
-            messageDiv.innerHTML = `<div class="${type}">${msg}</div>`;
+            // Messages can carry server error text, so they are set as text, never parsed as HTML
+            const messageEl = document.createElement('div');
+            messageEl.className = type;
+            messageEl.textContent = msg;
+            messageDiv.replaceChildren(messageEl);
             if (type === 'success' || type === 'error') {
                 setTimeout(() => {
-                    messageDiv.innerHTML = '';
+                    messageDiv.replaceChildren();
                 }, 5000);
             }
         }
 
+        let resultsETag = null;
+
         async function loadResults() {
             try {
-                const response = await fetch('/results');
-                const data = await response.json();
+                // Rows are rendered server-side; unchanged results come back as a 304
+                const response = await fetch('/results.html');
+                resultsETag = response.headers.get('ETag');
+                resultsContainer.innerHTML = await response.text();
+                localizeTimes(resultsContainer);
+            } catch (error) {
+                console.error('Error loading results:', error);
+            }
+        }
+
+        // Rows carry UTC timestamps from the server; show them in the viewer's local time
+        function localizeTimes(root) {
+            root.querySelectorAll('time[datetime]').forEach(time => {
+                time.textContent = new Date(time.dateTime).toLocaleString();
+            });
+        }
 
-                if (data.results && data.results.length > 0) {
-                    displayResults(data.results);
+        async function refreshResults() {
+            const tbody = resultsContainer.querySelector('.results-table tbody');
+            if (!tbody) {
+                loadResults();
+                return;
+            }
+            try {
+                // Revalidate by hand so a 304 means "nothing new" rather than a cached copy
+                const headers = resultsETag ? {'If-None-Match': resultsETag} : {};
+                const response = await fetch('/results.html', {cache: 'no-store', headers});
+                if (response.status === 304 || !response.ok) return;
+                resultsETag = response.headers.get('ETag');
+                const page = document.createElement('template');
+                page.innerHTML = await response.text();
+                localizeTimes(page.content);
+                // Prepend only rows not already shown, keeping open chats and loaded pages intact
+                const fresh = [...page.content.querySelectorAll('.results-table tbody > tr')]
+                    .filter(row => !tbody.querySelector(`tr[data-id="${row.dataset.id}"]`));
+                tbody.prepend(...fresh);
+            } catch (error) {
+                console.error('Error refreshing results:', error);
+            }
+        }
+
+        async function loadMoreResults(button) {
+            const tbody = resultsContainer.querySelector('.results-table tbody');
+            button.disabled = true;
+            try {
+                const response = await fetch(`/results.html?offset=${tbody.rows.length}`);
+                const page = document.createElement('template');
+                page.innerHTML = await response.text();
+                localizeTimes(page.content);
+                page.content.querySelectorAll('.results-table tbody > tr').forEach(row => {
+                    // Rows added live since the last page shift the offset; skip any already shown
+                    if (!tbody.querySelector(`tr[data-id="${row.dataset.id}"]`)) {
+                        tbody.appendChild(row);
+                    }
+                });
+                const next = page.content.querySelector('.load-more');
+                if (next) {
+                    button.replaceWith(next);
                 } else {
-                    resultsContainer.innerHTML = '<div class="no-results">No results yet. Upload an image to get started!</div>';
+                    button.remove();
                 }
             } catch (error) {
-                console.error('Error loading results:', error);
+                console.error('Error loading more results:', error);
+                button.disabled = false;
             }
         }
 
-        function displayResults(results) {
-            const table = document.createElement('table');
-            table.className = 'results-table';
-
-            table.innerHTML = `
-                <thead>
-                    <tr>
-                        <th style="width: 250px;">Image</th>
-                        <th>OCR Output</th>
-                        <th style="width: 150px;">Cost</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    ${results.map(result => `
-                        <tr>
-                            <td>
-                                <img src="/uploads/${result.filename}" alt="Uploaded image" class="thumbnail">
-                                <div style="margin-top: 8px; font-size: 12px; color: #666;">
-                                    <strong>Intent:</strong> ${escapeHtml(result.intent)}<br>
-                                    <strong>Model:</strong> ${escapeHtml(result.model || 'deepseek-ocr')}<br>
-                                    <strong>Date:</strong> ${new Date(result.timestamp).toLocaleString()}
-                                </div>
-                            </td>
-                            <td colspan="2">
-                                <div class="output-text">${escapeHtml(result.output)}</div>
-                                <button class="chat-toggle" onclick="toggleChat(${result.id})">💬 Chat about this image</button>
-                                <div id="chat-${result.id}" class="chat-section" style="display: none;">
-                                    <div class="chat-messages" id="chat-messages-${result.id}">
-                                        <div style="color: #666; font-style: italic; text-align: center;">No chat history yet. Ask a question about this image!</div>
-                                    </div>
-                                    <div class="chat-input-group">
-                                        <input type="text" id="chat-input-${result.id}" placeholder="Ask a question about this image..." onkeypress="if(event.key==='Enter') sendChat(${result.id})">
-                                        <button onclick="sendChat(${result.id})">Send</button>
-                                    </div>
-                                    <div style="margin-top: 10px; font-size: 12px; color: #666;">
-                                        <strong>Tokens:</strong> In: ${result.input_tokens || 0}, Out: ${result.output_tokens || 0} |
-                                        <strong style="color: #667eea;">Cost: $${(result.estimated_cost || 0).toFixed(4)}</strong>
-                                    </div>
-                                </div>
-                            </td>
-                        </tr>
-                    `).join('')}
-                </tbody>
-            `;
-
-            resultsContainer.innerHTML = '';
-            resultsContainer.appendChild(table);
-        }
-
-        function escapeHtml(text) {
-            const div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
+        async function showFullOutput(interactionId, button) {
+            button.disabled = true;
+            try {
+                const response = await fetch(`/results/${interactionId}`);
+                const data = await response.json();
+                document.getElementById(`output-${interactionId}`).textContent = data.output;
+                button.remove();
+            } catch (error) {
+                console.error('Error loading output:', error);
+                button.disabled = false;
+            }
         }
 
         async function loadStats() {
@@ -655,6 +1331,14 @@ HTML_TEMPLATE = '''
             }
         }
 
+        function renderChatMessage(role, content) {
+            const messageEl = chatMessageTpl.content.firstElementChild.cloneNode(true);
+            messageEl.classList.add(role);
+            messageEl.querySelector('.chat-role').textContent = role === 'user' ? 'You' : 'Assistant';
+            messageEl.querySelector('.chat-content').textContent = content;
+            return messageEl;
+        }
+
         async function loadChatHistory(interactionId) {
             try {
                 const response = await fetch(`/chat/${interactionId}`);
@@ -663,17 +1347,17 @@ HTML_TEMPLATE = '''
                 const messagesDiv = document.getElementById(`chat-messages-${interactionId}`);
 
                 if (data.messages && data.messages.length > 0) {
-                    messagesDiv.innerHTML = data.messages.map(msg => `
-                        <div class="chat-message ${msg.role}">
-                            <div style="font-weight: bold; margin-bottom: 5px;">${msg.role === 'user' ? 'You' : 'Assistant'}</div>
-                            <div>${escapeHtml(msg.content)}</div>
-                            <div style="font-size: 11px; margin-top: 5px; opacity: 0.8;">
-                                ${new Date(msg.timestamp).toLocaleTimeString()} • ${msg.tokens} tokens • $${msg.cost.toFixed(4)}
-                            </div>
-                        </div>
-                    `).join('');
+                    // Clone a template per message and fill it via textContent - no HTML parsing or escaping
+                    const fragment = document.createDocumentFragment();
+                    for (const msg of data.messages) {
+                        const messageEl = renderChatMessage(msg.role, msg.content);
+                        messageEl.querySelector('.chat-meta').textContent =
+                            `${new Date(msg.timestamp).toLocaleTimeString()} • ${msg.tokens} tokens • $${msg.cost.toFixed(4)}`;
+                        fragment.appendChild(messageEl);
+                    }
+                    messagesDiv.replaceChildren(fragment);
                 } else {
-                    messagesDiv.innerHTML = '<div style="color: #666; font-style: italic; text-align: center;">No chat history yet. Ask a question about this image!</div>';
+                    messagesDiv.replaceChildren(chatEmptyTpl.content.cloneNode(true));
                 }
 
                 messagesDiv.scrollTop = messagesDiv.scrollHeight;
@@ -691,8 +1375,18 @@ HTML_TEMPLATE = '''
             inputField.value = '';
             inputField.disabled = true;
 
+            // Show the question right away and fill in the answer as it streams in
+            const messagesDiv = document.getElementById(`chat-messages-${interactionId}`);
+            if (!messagesDiv.querySelector('.chat-message')) {
+                messagesDiv.replaceChildren();  // Drop the "no chat history" placeholder
+            }
+            const replyEl = renderChatMessage('assistant', '');
+            const replyContent = replyEl.querySelector('.chat-content');
+            messagesDiv.append(renderChatMessage('user', message), replyEl);
+            messagesDiv.scrollTop = messagesDiv.scrollHeight;
+
             try {
-                const response = await fetch(`/chat/${interactionId}`, {
+                const response = await fetch(`/chat/${interactionId}/stream`, {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json'
@@ -700,17 +1394,31 @@ HTML_TEMPLATE = '''
                     body: JSON.stringify({ message: message })
                 });
 
-                const data = await response.json();
+                if (!response.ok) {
+                    const data = await response.json();
+                    alert('Error: ' + data.error);
+                    return;
+                }
 
-                if (response.ok) {
-                    loadChatHistory(interactionId);
+                let result = null;
+                await readEvents(response, data => {
+                    if (data.response) {
+                        replyContent.textContent += data.response;
+                        messagesDiv.scrollTop = messagesDiv.scrollHeight;
+                    }
+                    if (data.done || data.error) result = data;
+                });
+
+                if (result && result.done) {
                     loadStats();
                 } else {
-                    alert('Error: ' + data.error);
+                    alert('Error: ' + (result ? result.error : 'Connection closed before the reply finished'));
                 }
             } catch (error) {
                 alert('Error: ' + error.message);
             } finally {
+                // Replace the provisional messages with the stored ones (timestamps, tokens, cost)
+                loadChatHistory(interactionId);
                 inputField.disabled = false;
                 inputField.focus();
             }
@@ -720,64 +1428,231 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
+# Results table rendered server-side and swapped into #resultsContainer by loadResults()
+RESULTS_TEMPLATE = '''
+{% macro result_row(result) %}
+<tr data-id="{{ result.id }}">
+    <td>
+        <a href="/uploads/{{ result.filename | urlencode }}" target="_blank">
+            <img src="/uploads/thumb/{{ result.filename | urlencode }}" alt="Uploaded image" class="thumbnail" loading="lazy">
+        </a>
+        <div style="margin-top: 8px; font-size: 12px; color: #666;">
+            <strong>Intent:</strong> {{ result.intent }}<br>
+            <strong>Model:</strong> {{ result.model or 'deepseek-ocr' }}<br>
+            <strong>Date:</strong> <time datetime="{{ result.timestamp | replace(' ', 'T') }}Z">{{ result.timestamp }} UTC</time>
+        </div>
+    </td>
+    <td colspan="2">
+        <div class="output-text" id="output-{{ result.id }}">{{ result.output }}{% if result.truncated %}…{% endif %}</div>
+        {% if result.truncated %}
+        <button class="chat-toggle" onclick="showFullOutput({{ result.id }}, this)">Show full output</button>
+        {% endif %}
+        <button class="chat-toggle" onclick="toggleChat({{ result.id }})">💬 Chat about this image</button>
+        <div id="chat-{{ result.id }}" class="chat-section" style="display: none;">
+            <div class="chat-messages" id="chat-messages-{{ result.id }}">
+                <div style="color: #666; font-style: italic; text-align: center;">No chat history yet. Ask a question about this image!</div>
+            </div>
+            <div class="chat-input-group">
+                <input type="text" id="chat-input-{{ result.id }}" placeholder="Ask a question about this image..." onkeypress="if(event.key==='Enter') sendChat({{ result.id }})">
+                <button onclick="sendChat({{ result.id }})">Send</button>
+            </div>
+            <div style="margin-top: 10px; font-size: 12px; color: #666;">
+                <strong>Tokens:</strong> In: {{ result.input_tokens or 0 }}, Out: {{ result.output_tokens or 0 }} |
+                <strong style="color: #667eea;">Cost: ${{ '%.4f' | format(result.estimated_cost or 0) }}</strong>
+            </div>
+        </div>
+    </td>
+</tr>
+{% endmacro %}
+
+{% if results %}
+<table class="results-table">
+    <thead>
+        <tr>
+            <th style="width: 250px;">Image</th>
+            <th>OCR Output</th>
+            <th style="width: 150px;">Cost</th>
+        </tr>
+    </thead>
+    <tbody>
+        {% for result in results %}
+        {{ result_row(result) }}
+        {% endfor %}
+    </tbody>
+</table>
+{% if has_more %}
+<button class="chat-toggle load-more" onclick="loadMoreResults(this)">Load more</button>
+{% endif %}
+{% else %}
+<div class="no-results">No results yet. Upload an image to get started!</div>
+{% endif %}
+'''
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
+# The index page has no template variables, so it is encoded once and served as-is
+INDEX_HTML = HTML_TEMPLATE.encode('utf-8')
+INDEX_ETAG = hashlib.md5(INDEX_HTML, usedforsecurity=False).hexdigest()
+# Compressed once here rather than per request
+INDEX_GZIP = gzip.compress(INDEX_HTML, compresslevel=9, mtime=0)
+INDEX_BROTLI = brotli.compress(INDEX_HTML) if brotli else None
 
-    file = request.files['file']
-    intent = request.form.get('intent', 'OCR this image.')
-    model = request.form.get('model', 'deepseek-ocr')
+# Compile the results template once at import instead of on every request
+RESULTS_TMPL = app.jinja_env.from_string(RESULTS_TEMPLATE)
 
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+def save_interaction(filename, intent, output, model, input_tokens=0, output_tokens=0, estimated_cost=0.0):
+    """Store an OCR result and return its id"""
+    with get_db(write=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_INSERT_INTERACTION, (filename, intent, output, model, input_tokens, output_tokens, estimated_cost))
+        return cursor.lastrowid
+
+def sse_event(data):
+    """Format a dict as a single Server-Sent Events message"""
+    return f"data: {orjson.dumps(data).decode()}\n\n"
+
+def describe_failure(e, action):
+    """Turn an exception raised while handling a model request into (user-facing message, HTTP status).
+
+    Must be called from an except block. Expected failures keep their specific message;
+    anything else is logged with its traceback and reported with a fixed message, so
+    exception internals never reach the client.
+    """
+    if isinstance(e, requests.Timeout):
+        return f'{action} timed out', 500
+    if isinstance(e, requests.ConnectionError):
+        return f'Could not connect to Ollama at {OLLAMA_URL}. Please ensure Ollama is running', 500
+    if isinstance(e, OllamaError):
+        return str(e), 502
+    if isinstance(e, requests.RequestException):
+        app.logger.exception('%s: request to Ollama failed', action)
+        return 'Upstream error', 502
+    app.logger.exception('%s failed', action)
+    return 'Internal error', 500
+
+def get_results_version():
+    """Cheap fingerprint of the interactions table that changes whenever a result is added.
+
+    Results are never deleted and ids are AUTOINCREMENT, so the newest id is enough; MAX()
+    on the rowid is a single B-tree seek, where COUNT(*) would scan the whole table.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_RESULTS_VERSION)
+        max_id, = cursor.fetchone()
+        return str(max_id or 0)
+
+def fetch_dicts(cursor, sql, params=()):
+    """Run a query and return its rows as plain dicts, skipping sqlite3.Row's per-field name lookups"""
+    cursor.row_factory = None
+    cursor.execute(sql, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def revalidated(etag, build):
+    """Return 304 if the client already holds `etag`, otherwise call build() and tag its response"""
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304)
+
+    response = build()
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'  # Always revalidate, but a match costs no body
+    return response
+
+def results_page_args():
+    """Read ?limit=&offset= for the results listings, clamped to sane bounds"""
+    limit = request.args.get('limit', RESULTS_PAGE_SIZE, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    return max(1, min(limit, RESULTS_MAX)), max(0, offset)
+
+def fetch_results_page(limit, offset):
+    """Newest-first page of interactions with truncated outputs, plus whether more rows follow"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        # One extra row tells us whether there is a next page without a COUNT(*)
+        rows = fetch_dicts(cursor, SQL_SELECT_RESULTS_PAGE,
+                           (RESULTS_PREVIEW_CHARS, RESULTS_PREVIEW_CHARS, limit + 1, offset))
+    return rows[:limit], len(rows) > limit
+
+@functools.lru_cache(maxsize=16)
+def render_results_html(version, limit, offset):
+    """Render one page of the results table; cached until the interactions table changes"""
+    rows, has_more = fetch_results_page(limit, offset)
+    return RESULTS_TMPL.render(results=rows, has_more=has_more)
+
+@functools.lru_cache(maxsize=16)
+def render_results_json(version, limit, offset):
+    """Serialize one page of /results; cached until the interactions table changes"""
+    results, has_more = fetch_results_page(limit, offset)
+    for result in results:
+        result['truncated'] = bool(result['truncated'])
+
+    return orjson.dumps({'results': results, 'limit': limit, 'offset': offset, 'has_more': has_more})
 
-    # Generate unique filename using timestamp
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{timestamp}_{file.filename}"
-    filepath = UPLOAD_FOLDER / filename
-    file.save(filepath)
+@app.route('/')
+def index():
+    if INDEX_BROTLI is not None and request.accept_encodings['br']:
+        encoding, body = 'br', INDEX_BROTLI
+    elif request.accept_encodings['gzip']:
+        encoding, body = 'gzip', INDEX_GZIP
+    else:
+        encoding, body = None, INDEX_HTML
+
+    # Each encoding is a distinct representation, so it gets its own ETag
+    etag = f'{INDEX_ETAG}-{encoding}' if encoding else INDEX_ETAG
+    if request.if_none_match.contains(etag):
+        return Response(status=304)
+
+    response = Response(body, mimetype='text/html')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
 
+@app.route('/upload', methods=['POST'])
+def upload_file():
     try:
-        # Build the prompt
-        # Add <|grounding|> prefix if not already present and not a general description
-        if intent.lower().startswith('describe this image'):
-            prompt = f"{filepath}\n{intent}"
-        elif not intent.startswith('<|grounding|>'):
-            prompt = f"{filepath}\n<|grounding|>{intent}"
-        else:
-            prompt = f"{filepath}\n{intent}"
-
-        # Call Ollama with specified model
-        result = subprocess.run(
-            ['ollama', 'run', model, prompt],
-            capture_output=True,
-            text=True,
-            timeout=120  # 2 minute timeout
-        )
+        filename, filepath = receive_upload()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        if result.returncode != 0:
-            return jsonify({'error': f'Ollama error: {result.stderr}'}), 500
+    # Form fields for multipart uploads, query parameters for raw-body uploads
+    intent = request.values.get('intent', 'OCR this image.')
+    model = request.values.get('model', 'deepseek-ocr')
 
-        output = result.stdout.strip()
+    try:
+        # The same image was already processed with this intent - skip the model call
+        cached_output = find_cached_result(filename, intent, model)
+        if cached_output is not None:
+            save_interaction(filename, intent, cached_output, model)
+            return jsonify({
+                'success': True,
+                'cached': True,
+                'filename': filename,
+                'output': cached_output,
+                'tokens': {
+                    'input': 0,
+                    'output': 0
+                },
+                'cost': 0.0
+            })
 
-        # Calculate token estimates and cost
-        input_tokens = estimate_tokens(intent)
-        output_tokens = estimate_tokens(output)
+        # Queue the calls to the Ollama daemon with specified model, one per page
+        prompt = build_prompt(intent)
+        futures = [
+            OCR_BATCHER.submit(model, prompt, page)
+            for page in load_pages(filepath)
+        ]
+        results = [future.result() for future in futures]
+        output = '\n\n'.join(result['response'].strip() for result in results)
+
+        # Use the token counts Ollama reports (prompt_eval_count is omitted when the prompt was cached)
+        input_tokens = sum(result.get('prompt_eval_count', 0) for result in results)
+        output_tokens = sum(result.get('eval_count', 0) for result in results)
         estimated_cost = calculate_cost(input_tokens, output_tokens, model)
 
         # Store the result in database
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO interactions (filename, intent, output, model, input_tokens, output_tokens, estimated_cost)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (filename, intent, output, model, input_tokens, output_tokens, estimated_cost))
-            conn.commit()
+        save_interaction(filename, intent, output, model, input_tokens, output_tokens, estimated_cost)
 
         return jsonify({
             'success': True,
@@ -790,181 +1665,342 @@ def upload_file():
             'cost': estimated_cost
         })
 
-    except subprocess.TimeoutExpired:
-        return jsonify({'error': 'OCR processing timed out'}), 500
-    except FileNotFoundError:
-        return jsonify({'error': 'Ollama not found. Please ensure Ollama is installed and in PATH'}), 500
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        error, status = describe_failure(e, 'OCR processing')
+        return jsonify({'error': error}), status
+
+@app.route('/upload/stream', methods=['POST'])
+def upload_file_stream():
+    """Same as /upload, but streams the model output as Server-Sent Events while it is generated"""
+    try:
+        filename, filepath = receive_upload()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Form fields for multipart uploads, query parameters for raw-body uploads
+    intent = request.values.get('intent', 'OCR this image.')
+    model = request.values.get('model', 'deepseek-ocr')
+
+    def stream():
+        try:
+            # The same image was already processed with this intent - skip the model call
+            cached_output = find_cached_result(filename, intent, model)
+            if cached_output is not None:
+                yield sse_event({'response': cached_output})
+                save_interaction(filename, intent, cached_output, model)
+                yield sse_event({
+                    'done': True,
+                    'cached': True,
+                    'filename': filename,
+                    'tokens': {'input': 0, 'output': 0},
+                    'cost': 0.0
+                })
+                return
+
+            # Forward tokens as Ollama produces them, one page after another
+            prompt = build_prompt(intent)
+            parts = []
+            input_tokens = output_tokens = 0
+            for page_number, page in enumerate(load_pages(filepath)):
+                if page_number:
+                    parts.append('\n\n')
+                    yield sse_event({'response': '\n\n'})
+                for chunk in ollama_generate_stream(model, prompt, [page]):
+                    if chunk['response']:
+                        parts.append(chunk['response'])
+                        yield sse_event({'response': chunk['response']})
+                    if chunk.get('done'):
+                        # The final chunk carries the token counts for the page
+                        input_tokens += chunk.get('prompt_eval_count', 0)
+                        output_tokens += chunk.get('eval_count', 0)
+            output = ''.join(parts).strip()
+
+            estimated_cost = calculate_cost(input_tokens, output_tokens, model)
+
+            # Store the full result once generation is done
+            save_interaction(filename, intent, output, model, input_tokens, output_tokens, estimated_cost)
+
+            yield sse_event({
+                'done': True,
+                'filename': filename,
+                'tokens': {'input': input_tokens, 'output': output_tokens},
+                'cost': estimated_cost
+            })
+
+        except Exception as e:
+            yield sse_event({'error': describe_failure(e, 'OCR processing')[0]})
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({'error': f'File too large; the maximum upload size is {MAX_UPLOAD_SIZE // (1024 * 1024)}MB'}), 413
 
 @app.route('/results', methods=['GET'])
 def get_results():
+    limit, offset = results_page_args()
+    version = get_results_version()
+    return revalidated(version, lambda: Response(render_results_json(version, limit, offset),
+                                                 mimetype='application/json'))
+
+@app.route('/results/<int:interaction_id>', methods=['GET'])
+def get_result(interaction_id):
+    """Full record for one interaction, including the untruncated output"""
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, filename, intent, output, model, input_tokens, output_tokens,
-                   estimated_cost, timestamp
-            FROM interactions
-            ORDER BY timestamp DESC
-        ''')
-        rows = cursor.fetchall()
-
-        results = []
-        for row in rows:
-            results.append({
-                'id': row['id'],
-                'filename': row['filename'],
-                'intent': row['intent'],
-                'output': row['output'],
-                'model': row['model'],
-                'input_tokens': row['input_tokens'],
-                'output_tokens': row['output_tokens'],
-                'estimated_cost': row['estimated_cost'],
-                'timestamp': row['timestamp']
-            })
+        rows = fetch_dicts(conn.cursor(), SQL_SELECT_RESULT, (interaction_id,))
 
-        return jsonify({'results': results})
+    if not rows:
+        return jsonify({'error': 'Interaction not found'}), 404
+
+    return jsonify(rows[0])
+
+@app.route('/results.html', methods=['GET'])
+def get_results_html():
+    limit, offset = results_page_args()
+    version = get_results_version()
+    return revalidated(version, lambda: Response(render_results_html(version, limit, offset),
+                                                 mimetype='text/html'))
 
 @app.route('/stats', methods=['GET'])
 def get_stats():
     with get_db() as conn:
         cursor = conn.cursor()
 
-        # Get interaction stats
-        cursor.execute('''
-            SELECT
-                COUNT(*) as total_interactions,
-                SUM(input_tokens + output_tokens) as total_tokens,
-                SUM(estimated_cost) as total_cost
-            FROM interactions
-        ''')
-        interaction_row = cursor.fetchone()
-
-        # Get chat message stats
-        cursor.execute('''
-            SELECT
-                SUM(tokens) as chat_tokens,
-                SUM(cost) as chat_cost
-            FROM chat_messages
-        ''')
-        chat_row = cursor.fetchone()
+        cursor.execute(SQL_SELECT_STATS)
+        row = cursor.fetchone()
 
-        total_tokens = (interaction_row['total_tokens'] or 0) + (chat_row['chat_tokens'] or 0)
-        total_cost = (interaction_row['total_cost'] or 0.0) + (chat_row['chat_cost'] or 0.0)
-
-        return jsonify({
-            'total_interactions': interaction_row['total_interactions'] or 0,
-            'total_tokens': total_tokens,
-            'total_cost': total_cost
-        })
+    # The stats row changes on every interaction and chat message, so it is its own version
+    version = f"{row['total_interactions']}-{row['total_tokens']}-{row['total_cost']!r}"
+    return revalidated(version, lambda: jsonify({
+        'total_interactions': row['total_interactions'],
+        'total_tokens': row['total_tokens'],
+        'total_cost': row['total_cost']
+    }))
 
 @app.route('/chat/<int:interaction_id>', methods=['GET'])
 def get_chat_history(interaction_id):
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT role, content, tokens, cost, timestamp
-            FROM chat_messages
-            WHERE interaction_id = ?
-            ORDER BY timestamp ASC
-        ''', (interaction_id,))
-        rows = cursor.fetchall()
-
-        messages = []
-        for row in rows:
-            messages.append({
-                'role': row['role'],
-                'content': row['content'],
-                'tokens': row['tokens'],
-                'cost': row['cost'],
-                'timestamp': row['timestamp']
-            })
+        messages = fetch_dicts(conn.cursor(), SQL_SELECT_CHAT_HISTORY, (interaction_id,))
 
-        return jsonify({'messages': messages})
+    return jsonify({'messages': messages})
 
-@app.route('/chat/<int:interaction_id>', methods=['POST'])
-def send_chat_message(interaction_id):
-    data = request.get_json()
-    message = data.get('message', '').strip()
-
-    if not message:
-        return jsonify({'error': 'No message provided'}), 400
-
-    # Get the original interaction details
+@functools.lru_cache(maxsize=1024)
+def _interaction_meta(interaction_id):
+    # Interactions are never modified once stored, so every later chat turn is served from memory.
+    # A missing id raises rather than returning None, so it is not cached
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT filename, model
-            FROM interactions
-            WHERE id = ?
-        ''', (interaction_id,))
+        cursor.execute(SQL_SELECT_INTERACTION_META, (interaction_id,))
         row = cursor.fetchone()
-
-        if not row:
-            return jsonify({'error': 'Interaction not found'}), 404
-
-        filename = row['filename']
-        model = row['model']
-        filepath = UPLOAD_FOLDER / filename
+    if row is None:
+        raise LookupError(interaction_id)
+    # Resolve the upload's path here too, so it is built once per interaction rather than per turn
+    return UPLOAD_FOLDER / row['filename'], row['model']
+
+def read_chat_request(interaction_id):
+    """Validate a chat POST and look up the image it is about.
+
+    Returns (message, filepath, model). Raises ValueError for a bad request body and
+    LookupError for an unknown interaction, both with a user-facing message. The lookup
+    is cached, so follow-up turns do no database work before the model call.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):  # Missing, malformed, or a JSON array/scalar
+        raise ValueError('Request body must be a JSON object')
+    message = data.get('message')
+    if not isinstance(message, str) or not message.strip():  # null or a number is not a question
+        raise ValueError('No message provided')
+    message = message.strip()
 
     try:
-        # Build prompt with image path
-        prompt = f"{filepath}\n{message}"
-
-        # Call Ollama with the model
-        result = subprocess.run(
-            ['ollama', 'run', model, prompt],
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
+        filepath, model = _interaction_meta(interaction_id)
+    except LookupError:
+        raise LookupError('Interaction not found')
+    return message, filepath, model
+
+def save_chat_turn(interaction_id, model, message, assistant_response, user_tokens, assistant_tokens):
+    """Store a question and the model's answer together; returns the combined cost of the turn"""
+    user_cost = calculate_cost(user_tokens, 0, model)
+    assistant_cost = calculate_cost(0, assistant_tokens, model)
+
+    with get_db(write=True) as conn:
+        conn.executemany(SQL_INSERT_CHAT, (
+            (interaction_id, 'user', message, user_tokens, user_cost),
+            (interaction_id, 'assistant', assistant_response, assistant_tokens, assistant_cost)
+        ))
+    return user_cost + assistant_cost
+
+class ChatReplyCache:
+    """Bounded LRU of recent chat replies, keyed by (interaction_id, message).
+
+    A retried or double-submitted question about the same image is answered from
+    memory instead of running the model again. Entries expire after ttl seconds, so
+    asking the same question again later gets a fresh answer.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._replies = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._replies.get(key)
+            if entry is None:
+                return None
+            stored_at, reply = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._replies[key]
+                return None
+            self._replies.move_to_end(key)
+            return reply
+
+    def put(self, key, reply):
+        with self._lock:
+            self._replies[key] = (time.monotonic(), reply)
+            self._replies.move_to_end(key)
+            if len(self._replies) > self.maxsize:
+                self._replies.popitem(last=False)
+
+CHAT_REPLIES = ChatReplyCache()
 
-        if result.returncode != 0:
-            return jsonify({'error': f'Ollama error: {result.stderr}'}), 500
+@app.route('/chat/<int:interaction_id>', methods=['POST'])
+def send_chat_message(interaction_id):
+    try:
+        message, filepath, model = read_chat_request(interaction_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+
+    # The same question about this image was answered moments ago - skip the model call
+    cached_reply = CHAT_REPLIES.get((interaction_id, message))
+    if cached_reply is not None:
+        save_chat_turn(interaction_id, model, message, cached_reply, 0, 0)
+        return jsonify({
+            'success': True,
+            'response': cached_reply,
+            'cached': True
+        })
 
-        assistant_response = result.stdout.strip()
+    try:
+        # Ask the already-loaded model through the daemon, sending the image alongside the question
+        result = ollama_generate(model, message, load_chat_pages(filepath))
+        assistant_response = result['response'].strip()
+        CHAT_REPLIES.put((interaction_id, message), assistant_response)
 
-        # Calculate tokens and cost
-        user_tokens = estimate_tokens(message)
-        assistant_tokens = estimate_tokens(assistant_response)
-        user_cost = calculate_cost(user_tokens, 0, model)
-        assistant_cost = calculate_cost(0, assistant_tokens, model)
+        # Use the token counts Ollama reports (prompt_eval_count is omitted when the prompt was cached)
+        user_tokens = result.get('prompt_eval_count', 0)
+        assistant_tokens = result.get('eval_count', 0)
 
         # Store chat messages in database
-        with get_db() as conn:
-            cursor = conn.cursor()
-
-            # Store user message
-            cursor.execute('''
-                INSERT INTO chat_messages (interaction_id, role, content, tokens, cost)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (interaction_id, 'user', message, user_tokens, user_cost))
-
-            # Store assistant response
-            cursor.execute('''
-                INSERT INTO chat_messages (interaction_id, role, content, tokens, cost)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (interaction_id, 'assistant', assistant_response, assistant_tokens, assistant_cost))
-
-            conn.commit()
+        save_chat_turn(interaction_id, model, message, assistant_response, user_tokens, assistant_tokens)
 
         return jsonify({
             'success': True,
             'response': assistant_response
         })
 
-    except subprocess.TimeoutExpired:
-        return jsonify({'error': 'Chat processing timed out'}), 500
-    except FileNotFoundError:
-        return jsonify({'error': 'Ollama not found'}), 500
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        error, status = describe_failure(e, 'Chat processing')
+        return jsonify({'error': error}), status
+
+@app.route('/chat/<int:interaction_id>/stream', methods=['POST'])
+def send_chat_message_stream(interaction_id):
+    """Same as POST /chat/<id>, but streams the reply as Server-Sent Events while it is generated"""
+    try:
+        message, filepath, model = read_chat_request(interaction_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+
+    def stream():
+        try:
+            # The same question about this image was answered moments ago - skip the model call
+            cached_reply = CHAT_REPLIES.get((interaction_id, message))
+            if cached_reply is not None:
+                yield sse_event({'response': cached_reply})
+                save_chat_turn(interaction_id, model, message, cached_reply, 0, 0)
+                yield sse_event({
+                    'done': True,
+                    'cached': True,
+                    'tokens': {'input': 0, 'output': 0},
+                    'cost': 0.0
+                })
+                return
+
+            parts = []
+            user_tokens = assistant_tokens = 0
+            for chunk in ollama_generate_stream(model, message, load_chat_pages(filepath)):
+                if chunk['response']:
+                    parts.append(chunk['response'])
+                    yield sse_event({'response': chunk['response']})
+                if chunk.get('done'):
+                    user_tokens = chunk.get('prompt_eval_count', 0)
+                    assistant_tokens = chunk.get('eval_count', 0)
+            assistant_response = ''.join(parts).strip()
+            CHAT_REPLIES.put((interaction_id, message), assistant_response)
+
+            # Store the turn once the full reply is in
+            cost = save_chat_turn(interaction_id, model, message, assistant_response, user_tokens, assistant_tokens)
+
+            yield sse_event({
+                'done': True,
+                'tokens': {'input': user_tokens, 'output': assistant_tokens},
+                'cost': cost
+            })
+
+        except Exception as e:
+            yield sse_event({'error': describe_failure(e, 'Chat processing')[0]})
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def send_upload(relative_path):
+    """Send a file from uploads/, letting nginx serve it when X_ACCEL_REDIRECT_PREFIX is set"""
+    if not X_ACCEL_REDIRECT_PREFIX:
+        # Under Gunicorn the file is passed to wsgi.file_wrapper, which uses sendfile(2)
+        response = send_from_directory(UPLOAD_FOLDER, relative_path, conditional=True, max_age=UPLOAD_MAX_AGE)
+    else:
+        filepath = safe_join(str(UPLOAD_FOLDER), relative_path)
+        if filepath is None or not os.path.isfile(filepath):
+            abort(404)
+
+        response = Response()
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + quote(relative_path)
+        del response.headers['Content-Type']  # nginx picks it from the file extension
+
+    # Uploads are named by content hash, so a URL's bytes never change: browsers need not revalidate
+    response.headers['Cache-Control'] = f'public, max-age={UPLOAD_MAX_AGE}, immutable'
+    return response
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_upload(filename)
+
+@app.route('/uploads/thumb/<filename>')
+def thumbnail_file(filename):
+    # Thumbnails are made at upload time; older uploads get theirs on first request
+    filepath = safe_join(str(UPLOAD_FOLDER), filename)
+    if filepath is None or not os.path.isfile(filepath):
+        abort(404)
+
+    thumb_path = make_thumbnail(Path(filepath))
+    if thumb_path is None:
+        abort(404)
+    return send_upload(f"{THUMB_FOLDER.name}/{thumb_path.name}")
 
 if __name__ == '__main__':
+    # Only reached under FLASK_ENV=development or on Windows (see the Gunicorn hand-off at the top).
+    # The debugger and reloader re-import the app and wrap every request, so they are opt-in
     print("Starting DeepSeek OCR Web App...")
     print("Open http://localhost:8080 in your browser")
-    app.run(debug=True, host='0.0.0.0', port=8080)
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    app.run(debug=debug, use_reloader=debug, host='0.0.0.0', port=8080, threaded=True)
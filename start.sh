@@ -13,7 +13,7 @@ fi
 source venv/bin/activate
 
 # Install dependencies if needed
-if ! pip show Flask > /dev/null 2>&1; then
+if ! python -c "import flask, requests, PIL, pymupdf, orjson, gunicorn" > /dev/null 2>&1; then
     echo "Installing dependencies..."
     pip install -r requirements.txt
 fi